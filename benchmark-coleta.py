@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Benchmark offline do coletor Mlabs
+
+Sobe dois substitutos locais e roda executar_coleta contra eles:
+- uma SPA falsa de relatórios do Mlabs (.dg-daterange-display, .report-period-modal,
+  cards .dg-metric) com latência e tamanho de dashboard configuráveis;
+- um stub compatível com o PostgREST para mlabs_reports.
+
+Para cada cenário (por padrão 4, 50 e 500 relatórios) mede o tempo total, o
+pico de memória (processo + browsers) e a latência de cada etapa (spans de
+Etapas). Precisa apenas do Chromium do Playwright instalado localmente.
+
+Uso:
+    python benchmark-coleta.py
+    python benchmark-coleta.py --relatorios 4,50 --concorrencia 8 --latencia-ms 100 --saida bench.json
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+PAGINA_RELATORIO = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Relatório {indice}</title></head>
+<body class="dg-analytics">
+    <header class="dg-report">
+        <div class="dg-daterange-display">Ontem</div>
+    </header>
+    <div class="report-period-modal" style="display:none">
+        <div class="report-period-modal__content__item__form">
+            <input class="select-input__input" readonly value="Ontem">
+            <ul class="select-input__options" style="display:none">
+                <li data-value="yesterday">Ontem</li>
+                <li data-value="last-7-days">Últimos 7 dias</li>
+                <li data-value="last-30-days">Últimos 30 dias</li>
+                <li data-value="custom">Personalizado</li>
+            </ul>
+            <input type="date" class="periodo-inicio" style="display:none">
+            <input type="date" class="periodo-fim" style="display:none">
+        </div>
+        <button class="btn">Salvar</button>
+    </div>
+    <main id="metricas" class="dg-dashboard"></main>
+    <script>
+        const indice = {indice};
+        const nosExtras = {nos_extras};
+        const modal = document.querySelector('.report-period-modal');
+        const opcoes = document.querySelector('.select-input__options');
+        const datas = document.querySelectorAll('.periodo-inicio, .periodo-fim');
+        let selecao = 'yesterday';
+
+        const renderizar = (dados) => {{
+            const partes = dados.metrics.map(m =>
+                `<div class="dg-metric"><span class="dg-metric__label">${{m.label}}</span>` +
+                `<span class="dg-metric__value">${{m.value.toLocaleString('en-US')}}</span>` +
+                `<span class="dg-metric__change">${{m.variation}}%</span></div>`
+            );
+            // Nós decorativos para simular dashboards grandes
+            for (let i = 0; i < nosExtras; i++) partes.push(`<div class="dg-card__decoracao"><span>${{i}}</span></div>`);
+            document.getElementById('metricas').innerHTML = partes.join('');
+        }};
+        const carregar = (query) => fetch(`/api/dados/${{indice}}?${{query}}`).then(r => r.json()).then(renderizar);
+
+        document.querySelector('.dg-daterange-display').onclick = () => {{ modal.style.display = 'block'; }};
+        document.querySelector('.select-input__input').onclick = () => {{ opcoes.style.display = 'block'; }};
+        opcoes.querySelectorAll('li').forEach(li => li.onclick = () => {{
+            selecao = li.dataset.value;
+            opcoes.style.display = 'none';
+            datas.forEach(d => d.style.display = selecao === 'custom' ? 'inline' : 'none');
+        }});
+        document.querySelector('.report-period-modal .btn').onclick = () => {{
+            modal.style.display = 'none';
+            const query = new URLSearchParams({{periodo: selecao, inicio: datas[0].value, fim: datas[1].value}});
+            carregar(query.toString());
+        }};
+        carregar('periodo=yesterday');
+    </script>
+</body>
+</html>
+"""
+
+class SpaMlabsFalsa(BaseHTTPRequestHandler):
+    """Páginas de relatório, login e endpoint de dados da SPA falsa"""
+
+    latencia_ms = 50
+    metricas = 20
+    nos_extras = 500
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status: int, corpo: str, tipo: str, cabecalhos=None):
+        dados = corpo.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(dados)))
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        partes = url.path.strip('/').split('/')
+        autenticado = 'sessao=bench' in (self.headers.get('Cookie') or '')
+        time.sleep(self.latencia_ms / 1000)
+
+        if partes[0] == 'auth':
+            self._responder(200, '<html><body>ok</body></html>', 'text/html',
+                            {'Set-Cookie': 'sessao=bench; Path=/'})
+        elif partes[0] == 'login':
+            self._responder(200, '<html><body><form action="/login"><input type="password"></form></body></html>', 'text/html')
+        elif not autenticado:
+            self._responder(302, '', 'text/html', {'Location': '/login'})
+        elif partes[0] == 'relatorio' and len(partes) == 2:
+            pagina = PAGINA_RELATORIO.format(indice=int(partes[1]), nos_extras=self.nos_extras)
+            self._responder(200, pagina, 'text/html; charset=utf-8')
+        elif partes[:2] == ['api', 'dados'] and len(partes) == 3:
+            periodo = parse_qs(url.query).get('periodo', ['yesterday'])[0]
+            semente = random.Random(f"{partes[2]}:{periodo}")
+            dados = {'metrics': [
+                {'label': f'Métrica {k}', 'value': semente.randint(0, 100000), 'variation': round(semente.uniform(-50, 50), 1)}
+                for k in range(self.metricas)
+            ]}
+            self._responder(200, json.dumps(dados, ensure_ascii=False), 'application/json')
+        else:
+            self._responder(404, '{}', 'application/json')
+
+class PostgrestFalso(BaseHTTPRequestHandler):
+    """Stub mínimo do PostgREST: select/filtros in. em mlabs_reports e upsert em memória"""
+
+    linhas = {}
+    indicadores = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status: int, corpo):
+        dados = json.dumps(corpo).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    @staticmethod
+    def _valores_in(filtro: str):
+        return next(csv.reader([filtro[len('in.('):-1]])) if filtro.startswith('in.(') else None
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        relatorios = self._valores_in(query.get('relatorio', [''])[0])
+        inicios = self._valores_in(query.get('periodo_inicio', [''])[0])
+        fins = self._valores_in(query.get('periodo_fim', [''])[0])
+        with self.lock:
+            linhas = [
+                dict(linha, periodo_inicio=linha['periodo']['inicio'], periodo_fim=linha['periodo']['fim'])
+                for linha in self.linhas.values()
+                if (relatorios is None or linha['relatorio'] in relatorios)
+                and (inicios is None or linha['periodo']['inicio'] in inicios)
+                and (fins is None or linha['periodo']['fim'] in fins)
+                and linha['indicadores']
+            ]
+        limite = query.get('limit')
+        self._responder(200, linhas[:int(limite[0])] if limite else linhas)
+
+    def do_POST(self):
+        corpo = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'[]')
+        normalizada = urlparse(self.path).path.endswith('/mlabs_indicadores')
+        with self.lock:
+            for linha in corpo if isinstance(corpo, list) else [corpo]:
+                if normalizada:
+                    self.indicadores[(linha['relatorio'], linha['indicador'], linha['periodo_inicio'], linha['periodo_fim'])] = linha
+                else:
+                    self.linhas[(linha['relatorio'], linha['periodo']['inicio'], linha['periodo']['fim'])] = linha
+        self._responder(201, [])
+
+def iniciar_servidor(handler) -> ThreadingHTTPServer:
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+def configurar_ambiente(url_spa: str, url_postgrest: str, diretorio: str):
+    """Aponta o coletor para os substitutos locais; precisa rodar antes de importar api.collect"""
+    os.environ.update({
+        'SUPABASE_URL': url_postgrest,
+        'SERVICE_ROLE_KEY': os.getenv('BENCH_SERVICE_ROLE_KEY', 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.bench'),
+        'BROWSERLESS_API_KEY': '',
+        'MLABS_PADROES_URL_DADOS': '/api/dados/',
+        'MLABS_SESSAO_STORE': 'arquivo',
+        'MLABS_SESSAO_CACHE': os.path.join(diretorio, 'sessao.json'),
+        'MLABS_ENDPOINTS_CACHE': os.path.join(diretorio, 'endpoints.json'),
+        'MLABS_SELETORES_CACHE': os.path.join(diretorio, 'seletores.json'),
+        'MLABS_DISJUNTOR_CACHE': os.path.join(diretorio, 'disjuntor.json'),
+        # Cenários grandes não podem ser cortados pelo orçamento da execução (medem a coleta inteira)
+        'MLABS_ORCAMENTO_EXECUCAO_S': os.getenv('BENCH_ORCAMENTO_EXECUCAO_S', '86400'),
+        'MLABS_RELATORIOS_FONTE': 'arquivo',
+    })
+
+def escrever_registro(caminho: str, url_spa: str, quantidade: int):
+    relatorios = [
+        {
+            'codigo': f'R{indice:04d}',
+            'titulo': f'Relatório benchmark {indice:04d}',
+            'url': f'{url_spa}/relatorio/{indice}',
+            'prioridade': indice
+        }
+        for indice in range(quantidade)
+    ]
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump({'relatorios': relatorios}, arquivo, ensure_ascii=False)
+
+class AmostradorMemoria:
+    """Amostra o RSS do processo e dos browsers filhos para registrar o pico"""
+
+    def __init__(self, intervalo: float = 0.25):
+        self.intervalo = intervalo
+        self.pico_mb = 0.0
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._amostrar, daemon=True)
+
+    @staticmethod
+    def rss_proprio_mb() -> float:
+        with open('/proc/self/status') as arquivo:
+            for linha in arquivo:
+                if linha.startswith('VmRSS:'):
+                    return int(linha.split()[1]) / 1024
+        return 0.0
+
+    def _amostrar(self):
+        from server import memoria_processos_filhos_mb
+        while not self._parar.is_set():
+            self.pico_mb = max(self.pico_mb, self.rss_proprio_mb() + memoria_processos_filhos_mb())
+            self._parar.wait(self.intervalo)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._parar.set()
+        self._thread.join()
+
+def percentil(valores, fracao: float) -> int:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(fracao * (len(ordenados) - 1))))]
+
+def resumir_etapas(resultado) -> dict:
+    """Agrupa os spans da execução e de cada relatório por etapa (p50/p95/máx em ms)"""
+    dados = resultado.get('data') or {}
+    spans = list(dados.get('etapas') or [])
+    for item in dados.get('resultados') or []:
+        spans.extend(item.get('etapas') or [])
+
+    por_etapa = {}
+    for span in spans:
+        por_etapa.setdefault(span['etapa'], []).append(span['duracao_ms'])
+    return {
+        etapa: {
+            'n': len(duracoes),
+            'p50_ms': percentil(duracoes, 0.5),
+            'p95_ms': percentil(duracoes, 0.95),
+            'max_ms': max(duracoes),
+            'total_ms': sum(duracoes)
+        }
+        for etapa, duracoes in sorted(por_etapa.items())
+    }
+
+def executar_cenario(quantidade: int, args, url_spa: str, diretorio: str) -> dict:
+    from api.collect import MlabsCollector, RegistroRelatorios
+
+    caminho_registro = os.path.join(diretorio, f'relatorios_{quantidade}.json')
+    escrever_registro(caminho_registro, url_spa, quantidade)
+    PostgrestFalso.linhas.clear()
+    PostgrestFalso.indicadores.clear()
+    if not args.reusar_sessao and os.path.exists(os.environ['MLABS_SESSAO_CACHE']):
+        os.remove(os.environ['MLABS_SESSAO_CACHE'])
+
+    coletor = MlabsCollector()
+    coletor._registro = RegistroRelatorios.carregar(fonte='arquivo', caminho=caminho_registro, recarregar=True)
+
+    print(f"\n🏁 Cenário: {quantidade} relatório(s), concorrência {args.concorrencia}, modo {args.modo}")
+    with AmostradorMemoria() as memoria:
+        inicio = time.monotonic()
+        resultado = asyncio.run(coletor.executar_coleta(
+            max_concorrencia=args.concorrencia, modo=args.modo, periodos=args.periodos, forcar=True
+        ))
+        duracao = time.monotonic() - inicio
+
+    dados = resultado.get('data') or {}
+    resultados = dados.get('resultados') or []
+    sucesso = sum(1 for item in resultados if item.get('status') == 'sucesso')
+    falhas = {}
+    for falha in dados.get('falhas') or []:
+        falhas[falha.get('categoria')] = falhas.get(falha.get('categoria'), 0) + 1
+    return {
+        'relatorios': quantidade,
+        'success': resultado.get('success'),
+        'erro': resultado.get('error'),
+        'tempo_total_s': round(duracao, 2),
+        # Só coletas bem-sucedidas contam: falhas (ex: orcamento) terminam rápido e inflariam a vazão
+        'relatorios_por_minuto': round(sucesso / duracao * 60, 1) if duracao else None,
+        'coletados': len(resultados),
+        'sucesso': sucesso,
+        'falhas': dict(sorted(falhas.items())),
+        'linhas_gravadas': len(PostgrestFalso.linhas),
+        'indicadores_gravados': len(PostgrestFalso.indicadores),
+        'pico_rss_mb': round(memoria.pico_mb, 1),
+        'etapas': resumir_etapas(resultado)
+    }
+
+def imprimir_cenario(cenario: dict):
+    print(f"\n📊 {cenario['relatorios']} relatório(s): {cenario['tempo_total_s']}s "
+          f"({cenario['relatorios_por_minuto']}/min), {cenario['sucesso']}/{cenario['coletados']} com sucesso, "
+          f"{cenario['linhas_gravadas']} linha(s) gravadas, pico de RSS {cenario['pico_rss_mb']} MB")
+    if cenario['falhas']:
+        print("   falhas: " + ', '.join(f"{categoria} {total}" for categoria, total in cenario['falhas'].items()))
+    if cenario['erro']:
+        print(f"   ❌ {cenario['erro']}")
+    print(f"   {'etapa':<20} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'máx ms':>8} {'total ms':>10}")
+    for etapa, tempos in cenario['etapas'].items():
+        print(f"   {etapa:<20} {tempos['n']:>6} {tempos['p50_ms']:>8} {tempos['p95_ms']:>8} "
+              f"{tempos['max_ms']:>8} {tempos['total_ms']:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline do coletor Mlabs')
+    parser.add_argument('--relatorios', default='4,50,500', help='Quantidades de relatórios (cenários), separadas por vírgula')
+    parser.add_argument('--concorrencia', type=int, default=4, help='max_concorrencia de executar_coleta')
+    parser.add_argument('--modo', default='browser', choices=('browser', 'api'))
+    parser.add_argument('--periodos', default=None, help='Especificação de períodos (ex: D-1,D-7); padrão D-1')
+    parser.add_argument('--latencia-ms', type=int, default=50, help='Latência de cada resposta da SPA falsa')
+    parser.add_argument('--metricas', type=int, default=20, help='Cards de métricas por dashboard')
+    parser.add_argument('--nos-extras', type=int, default=500, help='Nós decorativos por dashboard')
+    parser.add_argument('--reusar-sessao', action='store_true', help='Não apaga a sessão em cache entre cenários')
+    parser.add_argument('--saida', help='Grava os resultados em JSON neste arquivo')
+    args = parser.parse_args()
+
+    SpaMlabsFalsa.latencia_ms = args.latencia_ms
+    SpaMlabsFalsa.metricas = args.metricas
+    SpaMlabsFalsa.nos_extras = args.nos_extras
+    spa = iniciar_servidor(SpaMlabsFalsa)
+    postgrest = iniciar_servidor(PostgrestFalso)
+    url_spa = f"http://127.0.0.1:{spa.server_address[1]}"
+    url_postgrest = f"http://127.0.0.1:{postgrest.server_address[1]}"
+
+    diretorio = tempfile.mkdtemp(prefix='mlabs_bench_')
+    configurar_ambiente(url_spa, url_postgrest, diretorio)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import api.collect
+    # A URL de autenticação é lida a cada login, então pode ser trocada depois do import
+    os.environ['MLABS_AUTH_URL'] = f"{url_spa}/auth/bench"
+
+    print("🚀 Benchmark offline do coletor Mlabs")
+    print(f"⏰ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"🌐 SPA falsa: {url_spa} | PostgREST falso: {url_postgrest} | arquivos: {diretorio}")
+
+    cenarios = []
+    for quantidade in [int(valor) for valor in args.relatorios.split(',') if valor.strip()]:
+        cenario = executar_cenario(quantidade, args, url_spa, diretorio)
+        imprimir_cenario(cenario)
+        cenarios.append(cenario)
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump({
+                'timestamp': datetime.now().isoformat(),
+                'parametros': vars(args),
+                'cenarios': cenarios
+            }, arquivo, indent=2, ensure_ascii=False)
+        print(f"\n💾 Resultados gravados em {args.saida}")
+
+    spa.shutdown()
+    postgrest.shutdown()
+    return all(cenario['success'] for cenario in cenarios)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
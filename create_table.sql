@@ -8,13 +8,110 @@ CREATE TABLE IF NOT EXISTS public.mlabs_reports (
     inserted_at TIMESTAMPTZ DEFAULT NOW()
 );
 
--- Criar índice único para evitar duplicatas
-CREATE UNIQUE INDEX IF NOT EXISTS mlabs_reports_uniq
-    ON public.mlabs_reports (relatorio, (periodo->>'inicio'));
+-- Colunas geradas com o início e o fim do período: o upsert do coletor (on_conflict)
+-- precisa de colunas reais, não de expressões, para usar a chave do índice único
+ALTER TABLE public.mlabs_reports
+    ADD COLUMN IF NOT EXISTS periodo_inicio TEXT GENERATED ALWAYS AS (periodo->>'inicio') STORED;
+ALTER TABLE public.mlabs_reports
+    ADD COLUMN IF NOT EXISTS periodo_fim TEXT GENERATED ALWAYS AS (periodo->>'fim') STORED;
+
+-- Um registro por relatório e janela: D-1, D-7 e D-30 que começam no mesmo dia convivem.
+-- Os índices antigos, só pelo início, faziam essas janelas se sobrescreverem
+DROP INDEX IF EXISTS public.mlabs_reports_uniq;
+DROP INDEX IF EXISTS public.mlabs_reports_relatorio_periodo_uniq;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mlabs_reports_relatorio_janela_uniq
+    ON public.mlabs_reports (relatorio, periodo_inicio, periodo_fim);
 
 -- Adicionar comentários na tabela
 COMMENT ON TABLE public.mlabs_reports IS 'Tabela para armazenar relatórios coletados do Mlabs Analytics';
 COMMENT ON COLUMN public.mlabs_reports.coletado_em IS 'Data em que os dados foram coletados';
 COMMENT ON COLUMN public.mlabs_reports.relatorio IS 'Nome do relatório (ex: Adenis Facebook, Adenis Instagram)';
 COMMENT ON COLUMN public.mlabs_reports.periodo IS 'Período do relatório em formato JSON (inicio, fim)';
-COMMENT ON COLUMN public.mlabs_reports.indicadores IS 'Indicadores e métricas do relatório em formato JSON'; 
\ No newline at end of file
+COMMENT ON COLUMN public.mlabs_reports.indicadores IS 'Indicadores e métricas do relatório em formato JSON';
+
+-- Índice GIN no JSON completo, para consultas ad hoc por conteúdo (indicadores @> '[{"nome": ...}]')
+CREATE INDEX IF NOT EXISTS mlabs_reports_indicadores_gin
+    ON public.mlabs_reports USING GIN (indicadores jsonb_path_ops);
+
+-- Série temporal normalizada: uma linha por relatório, indicador e período, com valores numéricos
+CREATE TABLE IF NOT EXISTS public.mlabs_indicadores (
+    relatorio TEXT NOT NULL,
+    indicador TEXT NOT NULL,
+    periodo_inicio DATE NOT NULL,
+    periodo_fim DATE NOT NULL,
+    secao TEXT,
+    valor NUMERIC,
+    variacao_percentual NUMERIC,
+    coletado_em DATE NOT NULL,
+    atributos JSONB NOT NULL DEFAULT '{}'::jsonb,
+    atualizado_em TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (relatorio, indicador, periodo_inicio, periodo_fim)
+);
+
+-- Tabelas criadas com a chave antiga (só pelo início) passam a aceitar janelas que começam no mesmo dia
+ALTER TABLE public.mlabs_indicadores
+    DROP CONSTRAINT IF EXISTS mlabs_indicadores_pkey,
+    ADD CONSTRAINT mlabs_indicadores_pkey PRIMARY KEY (relatorio, indicador, periodo_inicio, periodo_fim);
+
+-- A chave primária atende tendências de um indicador (relatorio, indicador, intervalo de datas);
+-- este índice atende "todos os indicadores de um relatório em um intervalo"
+CREATE INDEX IF NOT EXISTS mlabs_indicadores_relatorio_periodo
+    ON public.mlabs_indicadores (relatorio, periodo_inicio);
+
+CREATE INDEX IF NOT EXISTS mlabs_indicadores_atributos_gin
+    ON public.mlabs_indicadores USING GIN (atributos jsonb_path_ops);
+
+COMMENT ON TABLE public.mlabs_indicadores IS 'Indicadores do Mlabs Analytics, uma linha por relatório, indicador e período';
+COMMENT ON COLUMN public.mlabs_indicadores.secao IS 'Seção do relatório em que o indicador aparece';
+COMMENT ON COLUMN public.mlabs_indicadores.atributos IS 'Campos não numéricos do indicador (valor_texto, serie, ...)';
+
+-- Carga inicial a partir do histórico de mlabs_reports (pode ser reexecutada)
+INSERT INTO public.mlabs_indicadores
+    (relatorio, indicador, periodo_inicio, periodo_fim, secao, valor, variacao_percentual, coletado_em, atributos)
+SELECT DISTINCT ON (r.relatorio, i->>'nome', (r.periodo->>'inicio')::date, (r.periodo->>'fim')::date)
+    r.relatorio,
+    i->>'nome',
+    (r.periodo->>'inicio')::date,
+    (r.periodo->>'fim')::date,
+    i->>'titulo',
+    CASE WHEN i->>'valor' ~ '^-?[0-9]+(\.[0-9]+)?([eE][-+]?[0-9]+)?$' THEN (i->>'valor')::numeric END,
+    CASE WHEN i->>'variacaoPercentual' ~ '^-?[0-9]+(\.[0-9]+)?([eE][-+]?[0-9]+)?$' THEN (i->>'variacaoPercentual')::numeric END,
+    r.coletado_em,
+    (i - 'nome' - 'titulo' - 'valor' - 'variacaoPercentual')
+FROM public.mlabs_reports r
+CROSS JOIN LATERAL jsonb_array_elements(r.indicadores) AS i
+WHERE coalesce(i->>'nome', '') <> ''
+ORDER BY r.relatorio, i->>'nome', (r.periodo->>'inicio')::date, (r.periodo->>'fim')::date, r.inserted_at DESC
+ON CONFLICT (relatorio, indicador, periodo_inicio, periodo_fim) DO UPDATE SET
+    secao = EXCLUDED.secao,
+    valor = EXCLUDED.valor,
+    variacao_percentual = EXCLUDED.variacao_percentual,
+    coletado_em = EXCLUDED.coletado_em,
+    atributos = EXCLUDED.atributos,
+    atualizado_em = NOW();
+
+-- Cache da sessão autenticada do Mlabs (storage_state do Playwright)
+CREATE TABLE IF NOT EXISTS public.mlabs_sessoes (
+    id TEXT PRIMARY KEY,
+    estado JSONB NOT NULL,
+    expira_em TIMESTAMPTZ NOT NULL,
+    atualizado_em TIMESTAMPTZ DEFAULT NOW()
+);
+
+COMMENT ON TABLE public.mlabs_sessoes IS 'Sessão autenticada do Mlabs reutilizada entre execuções do coletor';
+
+-- Registro de relatórios coletados (MLABS_RELATORIOS_FONTE=supabase)
+CREATE TABLE IF NOT EXISTS public.mlabs_relatorios (
+    codigo TEXT PRIMARY KEY,
+    titulo TEXT NOT NULL,
+    url TEXT NOT NULL,
+    ativo BOOLEAN NOT NULL DEFAULT TRUE,
+    prioridade INTEGER NOT NULL DEFAULT 100,
+    agenda TEXT NOT NULL DEFAULT 'diaria',
+    dicas JSONB NOT NULL DEFAULT '{}'::jsonb
+);
+
+COMMENT ON TABLE public.mlabs_relatorios IS 'Relatórios do Mlabs Analytics coletados pelo coletor';
+COMMENT ON COLUMN public.mlabs_relatorios.agenda IS 'diaria, semanal:<0-6> (0 = segunda) ou mensal:<1-31>';
+COMMENT ON COLUMN public.mlabs_relatorios.dicas IS 'Dicas de extração, ex: {"modo_extracao": "dom", "seletor_metricas": ".dg-metric"}';
@@ -5,23 +5,393 @@ Servidor local para desenvolvimento e testes do coletor Mlabs
 
 import os
 import json
+import gzip
+import time
 import asyncio
+import threading
+import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Iterable, Optional, Set, Tuple
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 from dotenv import load_dotenv
-from api.collect import collector
+from api.collect import (MlabsCollector, obter_coletor, executar_requisicao, parametros_coleta,
+                         total_fanout, autorizar_requisicao, _parametro, metricas,
+                         id_execucao, configurar_logs,
+                         consulta_indicadores, CABECALHOS_CORS_CONSULTA, TIPOS_STREAM, formato_stream,
+                         nivel_detalhe, aceita_gzip, aplicar_detalhe, resumir_relatorio, resumo_stream,
+                         evento_stream, CompressorGzip)
 
 # Carrega variáveis de ambiente
 load_dotenv()
 
+# Logs do servidor vão pelo mesmo handler (fila + JSON) do coletor
+logger = configurar_logs().getChild('servidor')
+
+# Pool de browsers aquecidos: quantidade, usos antes de reciclar e limite de memória (MB) por browser
+POOL_TAMANHO = int(os.getenv('MLABS_POOL_TAMANHO', '1'))
+POOL_MAX_USOS = int(os.getenv('MLABS_POOL_MAX_USOS', '20'))
+POOL_LIMITE_MEMORIA_MB = int(os.getenv('MLABS_POOL_LIMITE_MEMORIA_MB', '1500'))
+
+# Quantidade de jobs concluídos mantidos em memória para consulta
+JOBS_RETIDOS = int(os.getenv('MLABS_JOBS_RETIDOS', '100'))
+
+# Intervalo (s) dos comentários de keep-alive no SSE enquanto nenhum relatório termina
+INTERVALO_KEEPALIVE_SSE = float(os.getenv('MLABS_KEEPALIVE_SSE', '15'))
+
+# Respostas JSON menores que isso não compensam o gzip
+GZIP_MINIMO_BYTES = 1024
+
+def ler_processos() -> Tuple[Dict[int, int], Dict[int, int]]:
+    """Pai e RSS (bytes) de cada processo visível em /proc ({} fora do Linux)"""
+    pais: Dict[int, int] = {}
+    rss: Dict[int, int] = {}
+    try:
+        pids = list(filter(str.isdigit, os.listdir('/proc')))
+    except OSError:
+        return pais, rss
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as arquivo:
+                campos = arquivo.read().rsplit(')', 1)[1].split()
+            pais[int(pid)] = int(campos[1])
+            rss[int(pid)] = int(campos[21]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, IndexError, ValueError):
+            continue
+    return pais, rss
+
+def filhos_playwright() -> Set[int]:
+    """Processos filhos diretos deste servidor que são drivers do Playwright"""
+    pais, _ = ler_processos()
+    filhos = set()
+    for pid, pai in pais.items():
+        if pai != os.getpid():
+            continue
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as arquivo:
+                if b'playwright' in arquivo.read():
+                    filhos.add(pid)
+        except OSError:
+            continue
+    return filhos
+
+def memoria_processos_filhos_mb(raizes: Optional[Iterable[int]] = None) -> float:
+    """RSS somado (MB) das `raizes` e seus descendentes, via /proc
+    
+    Sem `raizes`, soma todos os descendentes deste servidor (browsers locais,
+    workers de extração etc.).
+    """
+    pais, rss = ler_processos()
+    descendentes = set(raizes) if raizes is not None else {os.getpid()}
+    alterou = True
+    while alterou:
+        alterou = False
+        for pid, pai in pais.items():
+            if pai in descendentes and pid not in descendentes:
+                descendentes.add(pid)
+                alterou = True
+    if raizes is None:
+        descendentes.discard(os.getpid())
+    return sum(rss.get(pid, 0) for pid in descendentes) / (1024 * 1024)
+
+class SlotBrowser:
+    """Um browser do pool com seu contador de usos
+    
+    `processos` são os drivers do Playwright iniciados para este slot (vazio
+    com Browserless): a memória do slot é a deles e de seus descendentes.
+    """
+    
+    def __init__(self, playwright, browser, processos: Optional[Set[int]] = None):
+        self.playwright = playwright
+        self.browser = browser
+        self.processos = processos or set()
+        self.usos = 0
+        self.criado_em = time.time()
+    
+    def memoria_mb(self) -> float:
+        return memoria_processos_filhos_mb(self.processos) if self.processos else 0.0
+    
+    async def fechar(self):
+        try:
+            await self.browser.close()
+        finally:
+            await self.playwright.stop()
+
+class PoolBrowsers:
+    """Browsers mantidos abertos pelo servidor e emprestados a cada coleta
+    
+    Cada empréstimo verifica a saúde do browser; browsers desconectados, que
+    atingiram POOL_MAX_USOS ou cuja árvore de processos passou de
+    POOL_LIMITE_MEMORIA_MB são reciclados. A sessão autenticada vem do cache de
+    sessão do coletor.
+    """
+    
+    def __init__(self, tamanho: int = POOL_TAMANHO, max_usos: int = POOL_MAX_USOS,
+                 limite_memoria_mb: int = POOL_LIMITE_MEMORIA_MB):
+        self.tamanho = max(1, tamanho)
+        self.max_usos = max_usos
+        self.limite_memoria_mb = limite_memoria_mb
+        self.livres: Optional[asyncio.Queue] = None
+        self.reciclados = 0
+        self._lock_criacao: Optional[asyncio.Lock] = None
+    
+    async def _novo_slot(self) -> SlotBrowser:
+        # Um slot por vez: o driver novo é o filho do Playwright que não existia antes
+        if self._lock_criacao is None:
+            self._lock_criacao = asyncio.Lock()
+        async with self._lock_criacao:
+            antes = filhos_playwright()
+            playwright, browser = await obter_coletor().get_browser()
+            return SlotBrowser(playwright, browser, filhos_playwright() - antes)
+    
+    async def iniciar(self):
+        self.livres = asyncio.Queue()
+        for _ in range(self.tamanho):
+            await self.livres.put(await self._novo_slot())
+        logger.info(f"🔥 Pool com {self.tamanho} browser(s) aquecido(s)")
+    
+    async def _saudavel(self, slot: SlotBrowser) -> bool:
+        if not slot.browser.is_connected():
+            return False
+        try:
+            context = await slot.browser.new_context()
+            await context.close()
+            return True
+        except Exception:
+            return False
+    
+    async def _reciclar(self, slot: SlotBrowser, motivo: str) -> SlotBrowser:
+        logger.info(f"♻️ Reciclando browser do pool ({motivo})")
+        self.reciclados += 1
+        try:
+            await slot.fechar()
+        except Exception as e:
+            logger.warning(f"⚠️ Erro ao fechar browser reciclado: {str(e)}")
+        return await self._novo_slot()
+    
+    @asynccontextmanager
+    async def browser(self):
+        """Empresta um browser saudável do pool durante o bloco"""
+        slot = await self.livres.get()
+        try:
+            if not await self._saudavel(slot):
+                slot = await self._reciclar(slot, 'health-check falhou')
+            slot.usos += 1
+            yield slot.browser
+        finally:
+            try:
+                memoria = slot.memoria_mb()
+                if slot.usos >= self.max_usos:
+                    slot = await self._reciclar(slot, f'{slot.usos} usos')
+                elif self.limite_memoria_mb and memoria > self.limite_memoria_mb:
+                    slot = await self._reciclar(slot, f'{memoria:.0f}MB de memória')
+            finally:
+                self.livres.put_nowait(slot)
+    
+    def resumo(self):
+        return {'tamanho': self.tamanho, 'livres': self.livres.qsize() if self.livres else 0, 'reciclados': self.reciclados}
+    
+    async def fechar(self):
+        while self.livres and not self.livres.empty():
+            await self.livres.get_nowait().fechar()
+
+class LoopServidor:
+    """Event loop persistente do servidor, rodando em uma thread própria
+    
+    Objetos do Playwright ficam presos ao loop em que foram criados, então o
+    pool só pode ser reaproveitado se todas as coletas rodarem no mesmo loop.
+    """
+    
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.pool = PoolBrowsers()
+    
+    def executar(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+    
+    async def coletar(self, query, coletor: Optional[MlabsCollector] = None):
+        if self.pool is None or 'fanout' in query:
+            return await executar_requisicao(query, coletor=coletor)
+        async with self.pool.browser() as browser:
+            return await executar_requisicao(query, browser=browser, coletor=coletor)
+    
+    def agendar(self, coro):
+        """Agenda a corrotina no loop do servidor sem bloquear a thread HTTP"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def iniciar_pool(self):
+        try:
+            self.executar(self.pool.iniciar())
+        except Exception as e:
+            # Sem pool, cada coleta inicia e encerra o próprio browser
+            logger.warning(f"⚠️ Não foi possível aquecer o pool de browsers: {str(e)}")
+            self.pool = None
+    
+    def parar(self):
+        if self.pool:
+            self.executar(self.pool.fechar())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+def chave_job(query) -> str:
+    """Identifica coletas equivalentes (mesmos relatórios, shard e períodos) para deduplicação"""
+    parametros = parametros_coleta(query)
+    periodos = parametros.get('periodos')
+    return json.dumps({
+        'periodos': periodos if periodos is not None else 'D-1',
+        'codigos': sorted(parametros.get('codigos') or []),
+        'shard': parametros.get('shard'),
+        'forcar': parametros.get('forcar', False),
+        'fanout': _parametro(query, 'fanout')
+    }, sort_keys=True)
+
+class Job:
+    """Uma coleta disparada pela API, com progresso por relatório"""
+    
+    def __init__(self, chave: str, query):
+        self.id = uuid.uuid4().hex[:12]
+        self.chave = chave
+        self.query = query
+        self.status = 'pendente'
+        self.criado_em = datetime.now().isoformat()
+        self.concluido_em: Optional[str] = None
+        self.relatorios = []
+        self.resultados = []
+        self.resultado = None
+        self.futuro = None
+        self.chamadas = 1
+        self.condicao = threading.Condition()
+    
+    def registrar_progresso(self, dados):
+        periodo = (dados.get('dados') or {}).get('periodo') or dados.get('periodo')
+        self.relatorios.append({
+            'codigo': dados.get('codigo'),
+            'titulo': dados.get('titulo'),
+            'periodo': periodo,
+            'status': dados.get('status'),
+            'erro': dados.get('erro')
+        })
+        with self.condicao:
+            self.resultados.append(dados)
+            self.condicao.notify_all()
+    
+    def concluir(self):
+        with self.condicao:
+            self.concluido_em = datetime.now().isoformat()
+            self.condicao.notify_all()
+    
+    def acompanhar(self, intervalo: Optional[float] = None):
+        """Gera os resultados publicados, desde o primeiro, até o job terminar
+        
+        Quem se junta a um job em andamento recebe também o que já foi coletado.
+        Com `intervalo`, gera None quando nada chega nesse tempo (keep-alive).
+        """
+        indice = 0
+        while True:
+            with self.condicao:
+                if indice >= len(self.resultados) and self.concluido_em is None:
+                    self.condicao.wait(intervalo)
+                novos = self.resultados[indice:]
+                terminou = self.concluido_em is not None
+            indice += len(novos)
+            yield from novos
+            if terminou and indice >= len(self.resultados):
+                return
+            if not novos and intervalo is not None:
+                yield None
+    
+    def resumo(self, incluir_resultado: bool = False):
+        resumo = {
+            'job_id': self.id,
+            'status': self.status,
+            'criado_em': self.criado_em,
+            'concluido_em': self.concluido_em,
+            'chamadas': self.chamadas,
+            'progresso': {
+                'concluidos': len(self.relatorios),
+                'sucesso': sum(1 for relatorio in self.relatorios if relatorio['status'] == 'sucesso'),
+                'relatorios': self.relatorios
+            }
+        }
+        if incluir_resultado and self.resultado is not None:
+            resumo['resultado'] = self.resultado
+        return resumo
+
+class GerenciadorJobs:
+    """Cria jobs de coleta e junta disparos equivalentes ao job que já está rodando"""
+    
+    def __init__(self, loop: LoopServidor, retidos: int = JOBS_RETIDOS):
+        self.loop = loop
+        self.retidos = retidos
+        self.jobs = {}
+        self.ativos = {}
+        self.lock = threading.Lock()
+    
+    def submeter(self, query):
+        """Retorna (job, novo); um job ativo com a mesma chave é reaproveitado"""
+        chave = chave_job(query)
+        with self.lock:
+            existente = self.ativos.get(chave)
+            if existente:
+                existente.chamadas += 1
+                return existente, False
+            
+            job = Job(chave, query)
+            self.jobs[job.id] = job
+            self.ativos[chave] = job
+            self._descartar_antigos()
+        
+        job.futuro = self.loop.agendar(self._executar(job))
+        return job, True
+    
+    async def _executar(self, job: Job):
+        # Cada job usa seu próprio coletor para não compartilhar estado de execução, mas os
+        # caches aprendidos e o disjuntor são os do coletor global, comuns a todos os jobs
+        coletor = MlabsCollector(base=obter_coletor())
+        coletor.ao_publicar = job.registrar_progresso
+        # O id do job correlaciona os logs da coleta
+        id_execucao.set(job.id)
+        job.status = 'executando'
+        try:
+            job.resultado = await self.loop.coletar(job.query, coletor)
+            job.status = 'concluido' if job.resultado.get('success') else 'erro'
+        except Exception as e:
+            job.resultado = {'success': False, 'error': str(e)}
+            job.status = 'erro'
+        finally:
+            job.concluir()
+            with self.lock:
+                self.ativos.pop(job.chave, None)
+        return job.resultado
+    
+    def _descartar_antigos(self):
+        concluidos = [job for job in self.jobs.values() if job.concluido_em]
+        for job in concluidos[:max(0, len(concluidos) - self.retidos)]:
+            del self.jobs[job.id]
+    
+    def obter(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            return self.jobs.get(job_id)
+    
+    def resumo(self):
+        with self.lock:
+            return {'ativos': len(self.ativos), 'retidos': len(self.jobs)}
+
+loop_servidor: Optional[LoopServidor] = None
+jobs: Optional[GerenciadorJobs] = None
+
 class MlabsHandler(BaseHTTPRequestHandler):
+    # Cabeçalhos de um stream já enviados: erros não podem mais virar outra resposta
+    stream_iniciado = False
+    
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
         self.end_headers()
     
     def do_GET(self):
@@ -32,14 +402,130 @@ class MlabsHandler(BaseHTTPRequestHandler):
         """Handle POST requests"""
         self.handle_request()
     
+    def log_message(self, formato, *args):
+        """Registra o acesso HTTP no logger estruturado em vez do stderr"""
+        logger.debug(formato % args, extra={'cliente': self.address_string()})
+    
+    def enviar_cabecalhos_cors(self):
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+    
+    def responder_json(self, status: int, corpo, comprimir: bool = False):
+        """Envia uma resposta JSON com os cabeçalhos de CORS (gzip se pedido e o cliente aceitar)"""
+        response_body = json.dumps(corpo, indent=2, ensure_ascii=False).encode('utf-8')
+        comprimir = comprimir and len(response_body) >= GZIP_MINIMO_BYTES and \
+            aceita_gzip(self.headers.get('Accept-Encoding'))
+        if comprimir:
+            response_body = gzip.compress(response_body)
+        
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if comprimir:
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(response_body)))
+        self.enviar_cabecalhos_cors()
+        self.end_headers()
+        self.wfile.write(response_body)
+    
+    def transmitir_job(self, job: Job, formato: str, detalhe: str):
+        """Transmite um evento por relatório assim que ele termina e, por fim, o resumo da execução
+        
+        A resposta não tem Content-Length: o fim do stream é o fechamento da conexão
+        (HTTP/1.0). Com gzip, cada evento é descarregado no cliente assim que é escrito.
+        Depois dos cabeçalhos, um erro vira um evento 'erro' final, nunca uma segunda resposta.
+        """
+        compressor = CompressorGzip() if aceita_gzip(self.headers.get('Accept-Encoding')) else None
+        self.stream_iniciado = True
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', f'{TIPOS_STREAM[formato]}; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.send_header('X-Job-Id', job.id)
+        if compressor:
+            self.send_header('Content-Encoding', 'gzip')
+        self.enviar_cabecalhos_cors()
+        self.end_headers()
+        
+        def escrever(dados: bytes):
+            self.wfile.write(compressor.comprimir(dados) if compressor else dados)
+            self.wfile.flush()
+        
+        transmitidos = 0
+        try:
+            intervalo = INTERVALO_KEEPALIVE_SSE if formato == 'sse' else None
+            for resultado in job.acompanhar(intervalo):
+                if resultado is None:
+                    escrever(b': keep-alive\n\n')
+                    continue
+                escrever(evento_stream('relatorio', resumir_relatorio(resultado) if detalhe == 'summary' else resultado, formato))
+                transmitidos += 1
+            final = job.resultado or {'success': False, 'error': 'Job terminou sem resultado'}
+            escrever(evento_stream('resumo', resumo_stream(final, detalhe, transmitidos), formato))
+            if compressor:
+                self.wfile.write(compressor.finalizar())
+        except (BrokenPipeError, ConnectionResetError):
+            # O job continua; o cliente pode acompanhar por /api/jobs/<id>
+            logger.info(f"🔌 Cliente desconectou do stream do job {job.id} após {transmitidos} relatório(s)")
+        except Exception as e:
+            logger.error(f"❌ Erro no stream do job {job.id}: {str(e)}")
+            try:
+                escrever(evento_stream('erro', {'success': False, 'error': str(e), 'job_id': job.id}, formato))
+                if compressor:
+                    self.wfile.write(compressor.finalizar())
+            except Exception:
+                pass
+    
+    def responder_metricas(self):
+        """Exporta as métricas da coleta e do servidor no formato texto do Prometheus"""
+        linhas = [metricas.exportar().rstrip('\n')]
+        estado_jobs = jobs.resumo()
+        linhas += [
+            '# HELP mlabs_jobs_ativos Jobs de coleta em execução',
+            '# TYPE mlabs_jobs_ativos gauge',
+            f"mlabs_jobs_ativos {estado_jobs['ativos']}"
+        ]
+        corpo = ('\n'.join(linha for linha in linhas if linha) + '\n').encode('utf-8')
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+    
+    def responder_indicadores(self, query):
+        """Consulta agregada do histórico, com cache e ETag (304 quando If-None-Match confere)"""
+        try:
+            resposta = loop_servidor.executar(
+                consulta_indicadores.responder(query, self.headers.get('If-None-Match'))
+            )
+        except ValueError as e:
+            self.responder_json(400, {'success': False, 'error': str(e)})
+            return
+        
+        self.send_response(resposta['statusCode'])
+        for nome, valor in {**resposta['headers'], **CABECALHOS_CORS_CONSULTA}.items():
+            self.send_header(nome, valor)
+        if resposta['body']:
+            self.send_header('Content-Length', str(len(resposta['body'])))
+        self.end_headers()
+        self.wfile.write(resposta['body'])
+    
     def handle_request(self):
-        """Processa requisições"""
+        """Processa requisições
+        
+        - POST /api/collect: cria (ou junta-se a) um job e retorna 202 com o job_id
+        - GET /api/collect: idem, mas aguarda o job e retorna o resultado (compatível com o cron)
+        - GET /api/collect?stream=ndjson|sse: um evento por relatório concluído e um resumo final
+        - GET /api/jobs/<id>: status e progresso por relatório
+        - GET /api/indicators: histórico agregado de mlabs_indicadores (cache + ETag)
+        - GET /metrics: contadores e histogramas por etapa (Prometheus)
+        - /health: não executa nenhuma coleta
+        """
+        self.stream_iniciado = False
         try:
-            # Configura CORS
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-            
             # Simula o objeto request da Vercel
             parsed_url = urlparse(self.path)
             request = {
@@ -48,30 +534,86 @@ class MlabsHandler(BaseHTTPRequestHandler):
                 'headers': dict(self.headers),
                 'query': parse_qs(parsed_url.query)
             }
+            rota = parsed_url.path.rstrip('/') or '/'
             
-            # Executa a coleta
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            resultado = loop.run_until_complete(collector.executar_coleta())
-            loop.close()
+            if rota == '/health':
+                self.responder_json(200, {
+                    'status': 'ok',
+                    'timestamp': datetime.now().isoformat(),
+                    'pool': loop_servidor.pool.resumo() if loop_servidor.pool else None,
+                    'jobs': jobs.resumo()
+                })
+                return
             
-            # Retorna resposta
-            if resultado['success']:
-                self.send_response(200)
-            else:
-                self.send_response(500)
+            if rota == '/metrics':
+                self.responder_metricas()
+                return
             
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
+            if rota == '/api/indicators':
+                self.responder_indicadores(request['query'])
+                return
             
-            response_body = json.dumps(resultado, indent=2, ensure_ascii=False)
-            self.wfile.write(response_body.encode('utf-8'))
+            # Formato (?stream=) e detalhe (?detail=) valem para a coleta e para os jobs
+            try:
+                formato = formato_stream(request['query'], self.headers.get('Accept'))
+                detalhe = nivel_detalhe(request['query'])
+            except ValueError as e:
+                self.responder_json(400, {'success': False, 'error': str(e)})
+                return
             
-        except Exception as e:
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
+            if rota.startswith('/api/jobs/'):
+                job = jobs.obter(rota.rsplit('/', 1)[1])
+                if job is None:
+                    self.responder_json(404, {'success': False, 'error': 'Job não encontrado'})
+                    return
+                if formato:
+                    self.transmitir_job(job, formato, detalhe)
+                    return
+                resumo = job.resumo(incluir_resultado=True)
+                if 'resultado' in resumo:
+                    resumo['resultado'] = aplicar_detalhe(resumo['resultado'], detalhe)
+                self.responder_json(200, resumo, comprimir=True)
+                return
+            
+            if rota != '/api/collect':
+                self.responder_json(404, {'success': False, 'error': f'Rota não encontrada: {rota}'})
+                return
+            
+            try:
+                parametros_coleta(request['query'])
+                total_fanout(request['query'])
+            except ValueError as e:
+                self.responder_json(400, {'success': False, 'error': str(e)})
+                return
+            negado = autorizar_requisicao(request['query'], self.headers.get('Authorization'))
+            if negado:
+                self.responder_json(negado[0], {'success': False, 'error': negado[1]})
+                return
+            
+            job, novo = jobs.submeter(request['query'])
+            
+            if self.command == 'POST':
+                resumo = job.resumo()
+                resumo['novo'] = novo
+                resumo['status_url'] = f'/api/jobs/{job.id}'
+                self.responder_json(202, resumo)
+                return
+            
+            # GET com ?stream= transmite cada relatório assim que termina
+            if formato:
+                self.transmitir_job(job, formato, detalhe)
+                return
             
+            # GET aguarda o job (novo ou já em andamento) e devolve o resultado completo
+            resultado = job.futuro.result()
+            self.responder_json(200 if resultado['success'] else 500, aplicar_detalhe(resultado, detalhe), comprimir=True)
+            
+        except Exception as e:
+            if getattr(self, 'stream_iniciado', False):
+                # Cabeçalhos já enviados: só resta encerrar a conexão
+                logger.error(f"❌ Erro após o início do stream: {str(e)}")
+                self.close_connection = True
+                return
             error_response = {
                 'success': False,
                 'error': str(e),
@@ -80,30 +622,32 @@ class MlabsHandler(BaseHTTPRequestHandler):
                     'ambiente': 'Local Python'
                 }
             }
-            
-            response_body = json.dumps(error_response, indent=2, ensure_ascii=False)
-            self.wfile.write(response_body.encode('utf-8'))
+            self.responder_json(500, error_response)
 
 def run_server(port=3000):
     """Inicia o servidor local"""
+    global loop_servidor, jobs
+    loop_servidor = LoopServidor()
+    loop_servidor.iniciar_pool()
+    jobs = GerenciadorJobs(loop_servidor)
+    
     server_address = ('', port)
-    httpd = HTTPServer(server_address, MlabsHandler)
-    
-    print(f"🚀 Servidor Python rodando em http://localhost:{port}")
-    print(f"📊 API disponível em http://localhost:{port}/api/collect")
-    print("📋 Variáveis de ambiente:")
-    print(f"- SUPABASE_URL: {'✅' if os.getenv('SUPABASE_URL') else '❌'}")
-    print(f"- SERVICE_ROLE_KEY: {'✅' if os.getenv('SERVICE_ROLE_KEY') else '❌'}")
-    print(f"- MLABS_AUTH_URL: {'✅' if os.getenv('MLABS_AUTH_URL') else '❌'}")
-    print(f"- MLABS_EMAIL: {'✅' if os.getenv('MLABS_EMAIL') else '❌'}")
-    print(f"- MLABS_PASSWORD: {'✅' if os.getenv('MLABS_PASSWORD') else '❌'}")
-    print(f"- BROWSERLESS_URL: {'✅' if os.getenv('BROWSERLESS_URL') else '❌ (usando padrão)'}")
+    httpd = ThreadingHTTPServer(server_address, MlabsHandler)
+    
+    logger.info(f"🚀 Servidor Python rodando em http://localhost:{port}")
+    logger.info(f"📊 API disponível em http://localhost:{port}/api/collect")
+    logger.info(f"📋 Jobs: POST /api/collect → GET /api/jobs/<id> | Health: /health")
+    logger.info(f"📈 Histórico: GET /api/indicators?relatorio=<título>&from=&to=&granularity=day|week|month")
+    # Só a presença das variáveis, nunca os valores
+    variaveis = ('SUPABASE_URL', 'SERVICE_ROLE_KEY', 'MLABS_AUTH_URL', 'MLABS_EMAIL', 'MLABS_PASSWORD', 'BROWSERLESS_URL')
+    logger.info("📋 Variáveis de ambiente", extra={'variaveis': {nome: bool(os.getenv(nome)) for nome in variaveis}})
     
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
-        print("\n🛑 Servidor parado pelo usuário")
+        logger.info("🛑 Servidor parado pelo usuário")
         httpd.server_close()
+        loop_servidor.parar()
 
 if __name__ == "__main__":
     PORT = int(os.getenv('PORT', 3000))
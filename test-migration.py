@@ -5,7 +5,9 @@ Script de teste para verificar a migração Python
 
 import os
 import sys
+import json
 import asyncio
+import subprocess
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -160,10 +162,10 @@ async def test_collector():
     print("\n🔍 Testando coletor principal...")
     
     try:
-        from api.collect import collector
+        from api.collect import obter_coletor
         
         # Testa apenas a conexão com Supabase (sem fazer scraping)
-        result = await collector.test_supabase_connection()
+        result = await obter_coletor().test_supabase_connection()
         
         if result:
             print("✅ Coletor funcionando")
@@ -176,6 +178,89 @@ async def test_collector():
         print(f"❌ Erro ao testar coletor: {str(e)}")
         return False
 
+def test_import_time():
+    """Mede o import de api.collect (cold start) em um processo limpo"""
+    print("\n🔍 Testando tempo de import (cold start)...")
+    
+    orcamento_ms = float(os.getenv('MLABS_IMPORT_BUDGET_MS', '300'))
+    script = (
+        "import sys, time, json\n"
+        "inicio = time.perf_counter()\n"
+        "import api.collect\n"
+        "ms = (time.perf_counter() - inicio) * 1000\n"
+        "pesados = [m for m in ('playwright', 'supabase', 'postgrest', 'httpx') if m in sys.modules]\n"
+        "print(json.dumps({'ms': ms, 'pesados': pesados}))\n"
+    )
+    # Sem credenciais: o import não pode depender do Supabase
+    ambiente = {k: v for k, v in os.environ.items() if k not in ('SUPABASE_URL', 'SERVICE_ROLE_KEY')}
+    ambiente['VERCEL'] = '1'
+    
+    try:
+        saida = subprocess.run(
+            [sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=ambiente, capture_output=True, text=True, timeout=60, check=True
+        )
+        medida = json.loads(saida.stdout.strip().splitlines()[-1])
+    except Exception as e:
+        print(f"❌ Erro ao importar api.collect: {str(e)}")
+        return False
+    
+    if medida['pesados']:
+        print(f"❌ Módulos carregados no import: {', '.join(medida['pesados'])}")
+        return False
+    if medida['ms'] > orcamento_ms:
+        print(f"❌ Import levou {medida['ms']:.0f}ms (orçamento {orcamento_ms:.0f}ms)")
+        return False
+    
+    print(f"✅ Import em {medida['ms']:.0f}ms (orçamento {orcamento_ms:.0f}ms)")
+    return True
+
+def test_extrator_html():
+    """Extrai KPIs de um snapshot HTML com nomes repetidos entre card, tabela e gráfico"""
+    print("\n🔍 Testando extrator de snapshots HTML...")
+    
+    html = """
+    <html><body>
+        <div class="chart-container"><h3>Alcance</h3><canvas></canvas></div>
+        <table><tr><td>Curtidas</td><td>1,200</td></tr></table>
+        <div class="dg-metric">
+            <div class="dg-metric__label">Alcance</div>
+            <div class="dg-metric__value">12,345</div>
+            <div class="dg-metric__change">+3.5%</div>
+        </div>
+        <div class="dg-metric">
+            <div class="dg-metric__label">Curtidas</div>
+            <div class="dg-metric__value">1,002</div>
+            <div class="dg-metric__change">-1.2%</div>
+        </div>
+        <div class="chart-container"><h3>Curtidas</h3><svg></svg></div>
+    </body></html>
+    """
+    esperado = {
+        'Alcance': {'valor': '12345', 'variacaoPercentual': 3.5},
+        'Curtidas': {'valor': '1002', 'variacaoPercentual': -1.2},
+    }
+    
+    try:
+        from api.collect import extrair_kpis_html, descompactar_kpis
+        indicadores = {kpi['nome']: kpi for kpi in descompactar_kpis(extrair_kpis_html(html))}
+    except Exception as e:
+        print(f"❌ Erro ao extrair KPIs do snapshot: {str(e)}")
+        return False
+    
+    for nome, campos in esperado.items():
+        kpi = indicadores.get(nome)
+        if not kpi or any(kpi[campo] != valor for campo, valor in campos.items()):
+            print(f"❌ Indicador {nome} incorreto: {kpi}")
+            return False
+        # O card substitui a série registrada antes (gráfico) e vence a registrada depois
+        if 'serie' in kpi:
+            print(f"❌ Indicador {nome} marcado como série: {kpi}")
+            return False
+    
+    print(f"✅ {len(indicadores)} indicadores extraídos do snapshot")
+    return True
+
 def main():
     """Função principal de teste"""
     print("🚀 Iniciando testes da migração Python...")
@@ -193,6 +278,12 @@ def main():
         print("💡 Execute: pip install -r requirements.txt")
         return False
     
+    # Testa cold start
+    import_ok = test_import_time()
+    
+    # Testa o extrator de snapshots HTML
+    extrator_ok = test_extrator_html()
+    
     # Executa testes assíncronos
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -218,8 +309,11 @@ def main():
     print(f"✅ Supabase: {'OK' if supabase_ok else 'ERRO'}")
     print(f"✅ Browserless: {'OK' if browserless_ok else 'ERRO'}")
     print(f"✅ Coletor: {'OK' if collector_ok else 'ERRO'}")
+    print(f"✅ Import: {'OK' if import_ok else 'ERRO'}")
+    print(f"✅ Extrator HTML: {'OK' if extrator_ok else 'ERRO'}")
     
-    all_ok = test_environment() and test_dependencies() and supabase_ok and browserless_ok and collector_ok
+    all_ok = (test_environment() and test_dependencies() and supabase_ok and browserless_ok
+              and collector_ok and import_ok and extrator_ok)
     
     if all_ok:
         print("\n🎉 Todos os testes passaram! Migração Python funcionando.")